@@ -1,12 +1,14 @@
-from .parsers import get_code_parser, ParsedFileResult, ExtractedFunction, ExtractedClass, ExtractedImport, BaseCodeParser
+from .parsers import get_code_parser, parse_many, ParsedFileResult, ExtractedFunction, ExtractedClass, ExtractedImport, BaseCodeParser, TreeEdit
 from .builder import CKGBuilder
 
 __all__ = [
     "get_code_parser",
+    "parse_many",
     "ParsedFileResult",
     "ExtractedFunction",
     "ExtractedClass",
     "ExtractedImport",
     "BaseCodeParser",
+    "TreeEdit",
     "CKGBuilder"
 ]
\ No newline at end of file
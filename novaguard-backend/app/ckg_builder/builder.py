@@ -1,12 +1,14 @@
 # novaguard-backend/app/ckg_builder/builder.py
+import asyncio
 import logging
+from functools import partial
 from pathlib import Path
 from typing import List, Optional, Dict, Any, Tuple
 from neo4j import AsyncDriver
 
 from app.core.graph_db import get_async_neo4j_driver
 from app.models import Project
-from .parsers import get_code_parser, ParsedFileResult, ExtractedFunction, ExtractedClass, ExtractedImport
+from .parsers import get_code_parser, parse_many, ParsedFileResult, ExtractedFunction, ExtractedClass, ExtractedImport
 
 logger = logging.getLogger(__name__)
 
@@ -139,7 +141,9 @@ class CKGBuilder:
 
         logger.info(f"CKGBuilder: Processing CKG for '{file_path_in_repo}' (lang: {language}), project: '{self.project_graph_id}'.")
         parsed_data: Optional[ParsedFileResult] = parser.parse(file_content, file_path_in_repo)
+        await self._write_parsed_file_to_ckg(file_path_in_repo, parsed_data, language)
 
+    async def _write_parsed_file_to_ckg(self, file_path_in_repo: str, parsed_data: Optional[ParsedFileResult], language: str):
         if not parsed_data:
             logger.error(f"CKGBuilder: Failed to parse file {file_path_in_repo} for CKG.")
             return
@@ -287,7 +291,7 @@ class CKGBuilder:
             ))
 
         if cypher_batch:
-            logger.debug(f"CKGBuilder: Executing initial batch of {len(cypher_batch)} Cypher queries for file {file_path_in_repo}.")
+            logger.debug("CKGBuilder: Executing initial batch of %d Cypher queries for file %s.", len(cypher_batch), file_path_in_repo)
             await self._execute_write_queries(cypher_batch)
 
         # 5. Link CALLS
@@ -369,7 +373,7 @@ class CKGBuilder:
                 call_link_queries_batch.append((resolve_and_link_query, call_params))
 
         if call_link_queries_batch:
-            logger.debug(f"CKGBuilder: Executing batch of {len(call_link_queries_batch)} CALLS link queries for file {file_path_in_repo}.")
+            logger.debug("CKGBuilder: Executing batch of %d CALLS link queries for file %s.", len(call_link_queries_batch), file_path_in_repo)
             await self._execute_write_queries(call_link_queries_batch)
 
         logger.info(f"CKGBuilder: Finished CKG processing for file '{file_path_in_repo}'.")
@@ -421,27 +425,27 @@ class CKGBuilder:
             if not file_p.is_file():
                 continue
 
-            relative_path_parts = file_p.relative_to(source_path_obj).parts
-            if any(part.lower() in ignored_parts for part in relative_path_parts) or \
+            relative_path = file_p.relative_to(source_path_obj)
+            if any(part.lower() in ignored_parts for part in relative_path.parts) or \
                any(file_p.name.lower().endswith(ext) for ext in ignored_parts if not ext.startswith('.')) or \
                (file_p.name.startswith('.') and file_p.name not in ['.env', '.flaskenv']): # Bỏ qua file ẩn trừ một số file cụ thể
-                logger.debug(f"CKGBuilder: Skipping ignored file/path: {file_p.relative_to(source_path_obj)}")
+                logger.debug("CKGBuilder: Skipping ignored file/path: %s", relative_path)
                 continue
 
             if file_p.suffix.lower() in ignored_extensions:
-                logger.debug(f"CKGBuilder: Skipping file with ignored extension: {file_p.relative_to(source_path_obj)}")
+                logger.debug("CKGBuilder: Skipping file with ignored extension: %s", relative_path)
                 continue
 
             try:
                 file_size = file_p.stat().st_size
                 if file_size < min_file_size_for_ckg:
-                    logger.debug(f"CKGBuilder: Skipping too small file: {file_p.relative_to(source_path_obj)} ({file_size} bytes)")
+                    logger.debug("CKGBuilder: Skipping too small file: %s (%d bytes)", relative_path, file_size)
                     continue
                 if file_size > max_file_size_for_ckg:
-                    logger.warning(f"CKGBuilder: Skipping too large file: {file_p.relative_to(source_path_obj)} ({file_size} bytes)")
+                    logger.warning(f"CKGBuilder: Skipping too large file: {relative_path} ({file_size} bytes)")
                     continue
             except OSError: # Có thể xảy ra với broken symlinks
-                logger.warning(f"CKGBuilder: Could not stat file (possibly broken symlink): {file_p.relative_to(source_path_obj)}. Skipping.")
+                logger.warning(f"CKGBuilder: Could not stat file (possibly broken symlink): {relative_path}. Skipping.")
                 continue
 
             file_lang = common_code_extensions.get(file_p.suffix.lower())
@@ -454,33 +458,44 @@ class CKGBuilder:
             if file_lang:
                 files_to_process.append((file_p, file_lang))
             else:
-                logger.debug(f"CKGBuilder: Skipping file with unsupported/unknown code extension for CKG: {file_p.relative_to(source_path_obj)}")
+                logger.debug("CKGBuilder: Skipping file with unsupported/unknown code extension for CKG: %s", relative_path)
 
         logger.info(f"CKGBuilder: Found {len(files_to_process)} files to process for CKG.")
 
+        # Parse song song theo từng ngôn ngữ (process pool, đọc file qua mmap); ghi vào Neo4j vẫn tuần tự theo file.
+        # Đường dẫn trong kết quả là đường dẫn tương đối trong repo (cũng là key của parse cache).
+        files_by_language: Dict[str, List[str]] = {}
         for file_p, lang_to_use in files_to_process:
-            file_path_in_repo = str(file_p.relative_to(source_path_obj))
-            try:
-                try:
-                    content = file_p.read_text(encoding='utf-8')
-                except UnicodeDecodeError:
-                    logger.warning(f"CKGBuilder: UTF-8 decode error for {file_path_in_repo}. Trying 'latin-1'.")
-                    try:
-                        content = file_p.read_text(encoding='latin-1')
-                    except Exception as e_enc:
-                        logger.error(f"CKGBuilder: Could not read file {file_path_in_repo} due to encoding: {e_enc}. Skipping.")
-                        continue
-                except OSError as e_os_read: # Ví dụ file bị xóa giữa chừng
-                    logger.error(f"CKGBuilder: OS error reading file {file_path_in_repo}: {e_os_read}. Skipping.")
-                    continue
-
+            files_by_language.setdefault(lang_to_use, []).append(str(file_p.relative_to(source_path_obj)))
 
-                await self.process_file_for_ckg(file_path_in_repo, content, lang_to_use)
-                files_processed_count += 1
+        loop = asyncio.get_running_loop()
+        for lang_to_use, file_paths_in_repo in files_by_language.items():
+            if not get_code_parser(lang_to_use):
+                logger.warning(f"CKGBuilder: No parser for lang '{lang_to_use}'. Skipping CKG for {len(file_paths_in_repo)} files.")
+                continue
+            try:
+                parsed_results = await loop.run_in_executor(
+                    None, partial(parse_many, file_paths_in_repo, lang_to_use, root_dir=str(source_path_obj))
+                )
             except Exception as e:
-                logger.error(f"CKGBuilder: Critical error processing file {file_path_in_repo} for CKG: {e}", exc_info=True)
-                # Cân nhắc việc có nên dừng toàn bộ quá trình build CKG của project nếu một file lỗi nặng không.
-                # Hoặc chỉ bỏ qua file đó.
+                # Ví dụ không tạo được process pool: parse tuần tự trong process hiện tại (parse_file tự bắt lỗi từng file)
+                logger.error(f"CKGBuilder: Parallel parsing failed for {len(file_paths_in_repo)} '{lang_to_use}' files: {e}. Falling back to in-process parsing.", exc_info=True)
+                parsed_results = await loop.run_in_executor(
+                    None, partial(parse_many, file_paths_in_repo, lang_to_use, max_workers=1, root_dir=str(source_path_obj))
+                )
+
+            for file_path_in_repo, parsed_data in zip(file_paths_in_repo, parsed_results):
+                if parsed_data is None:
+                    logger.error(f"CKGBuilder: Could not read or parse file {file_path_in_repo} for CKG. Skipping.")
+                    continue
+                try:
+                    logger.info(f"CKGBuilder: Processing CKG for '{file_path_in_repo}' (lang: {lang_to_use}), project: '{self.project_graph_id}'.")
+                    await self._write_parsed_file_to_ckg(file_path_in_repo, parsed_data, lang_to_use)
+                    files_processed_count += 1
+                except Exception as e:
+                    logger.error(f"CKGBuilder: Critical error processing file {file_path_in_repo} for CKG: {e}", exc_info=True)
+                    # Cân nhắc việc có nên dừng toàn bộ quá trình build CKG của project nếu một file lỗi nặng không.
+                    # Hoặc chỉ bỏ qua file đó.
 
         logger.info(f"CKGBuilder: Finished CKG build for project '{self.project_graph_id}'. Processed {files_processed_count} files for CKG.")
         return files_processed_count
\ No newline at end of file
@@ -0,0 +1,110 @@
+# novaguard-ai2/novaguard-backend/app/ckg_builder/parse_cache.py
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tăng giá trị này mỗi khi logic extract thay đổi để các entry cũ tự động không còn khớp
+PARSE_CACHE_FORMAT_VERSION = 1
+# Số entry tối đa mặc định; vượt quá thì xóa các entry cũ nhất
+DEFAULT_MAX_ENTRIES = 100_000
+
+class ParsedResultCache:
+    """
+    Cache ParsedFileResult trên đĩa (SQLite), key theo (path, sha256(nội dung)).
+    File không đổi nội dung giữa các lần build CKG sẽ không cần parse lại.
+    Cache dùng chung cho mọi project/branch: cùng path (vd. app/main.py) với nội dung khác nhau là các entry riêng,
+    không thay thế nhau; số entry được giới hạn bằng max_entries, xóa theo thứ tự entry cũ nhất.
+    An toàn khi process bị fork (parse_many): process con tự mở connection riêng ở lần dùng đầu tiên.
+    """
+    # Kiểm tra giới hạn số entry sau mỗi chừng này lần put (mỗi process), không đếm bảng ở mọi lần ghi
+    EVICTION_CHECK_INTERVAL = 256
+
+    def __init__(self, cache_path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self._puts_since_eviction_check = 0
+        self._lock = threading.Lock()
+        # Mở ngay để lỗi đường dẫn (thư mục không tồn tại, volume read-only...) lộ ra lúc khởi tạo
+        self._conn = self._connect()
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.cache_path, timeout=30, check_same_thread=False)
+        with conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(parsed_cache)")}
+            if columns and "created_at" not in columns: # Cache tạo bởi phiên bản cũ (chưa có created_at) -> tạo lại
+                conn.execute("DROP TABLE parsed_cache")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parsed_cache ("
+                "path TEXT NOT NULL, content_sha BLOB NOT NULL, pickled BLOB NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (path, content_sha))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS parsed_cache_created_at ON parsed_cache (created_at)")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite cấm dùng connection qua fork() (lock POSIX không được kế thừa) -> process con mở connection mới.
+        # Lock kế thừa cũng có thể đang bị giữ đúng lúc fork nên được tạo lại; connection cũ bỏ đi, không close.
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._conn = self._connect()
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def content_key(language: str, source_bytes: bytes) -> bytes:
+        hasher = hashlib.sha256(f"{PARSE_CACHE_FORMAT_VERSION}:{language}:".encode("utf8"))
+        hasher.update(source_bytes)
+        return hasher.digest()
+
+    def get(self, path: str, content_sha: bytes):
+        try:
+            conn = self._connection()
+            with self._lock:
+                row = conn.execute(
+                    "SELECT pickled FROM parsed_cache WHERE path = ? AND content_sha = ?", (path, content_sha)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"ParsedResultCache: Could not read cache entry for {path}, parsing without cache: {e}")
+            return None
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logger.warning(f"ParsedResultCache: Corrupt cache entry for {path}, ignoring: {e}")
+            return None
+
+    def put(self, path: str, content_sha: bytes, result) -> None:
+        pickled = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            conn = self._connection()
+            with self._lock, conn:
+                # Không xóa entry khác của cùng path: path chỉ duy nhất trong một repo, còn cache dùng chung cho nhiều project
+                conn.execute(
+                    "INSERT OR REPLACE INTO parsed_cache (path, content_sha, pickled, created_at) VALUES (?, ?, ?, ?)",
+                    (path, content_sha, pickled, time.time())
+                )
+                self._puts_since_eviction_check += 1
+                if self._puts_since_eviction_check >= self.EVICTION_CHECK_INTERVAL:
+                    self._puts_since_eviction_check = 0
+                    conn.execute(
+                        "DELETE FROM parsed_cache WHERE rowid IN ("
+                        "SELECT rowid FROM parsed_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,)
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"ParsedResultCache: Could not store cache entry for {path}: {e}")
+
+    def close(self) -> None:
+        # Chỉ đóng connection do chính process này mở
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._conn.close()
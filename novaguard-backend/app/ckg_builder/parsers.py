@@ -1,13 +1,75 @@
 # novaguard-ai2/novaguard-backend/app/ckg_builder/parsers.py
 import logging
-from typing import List, Dict, Any, Tuple, Optional, Set
-from tree_sitter import Language, Parser, Node, Query # type: ignore
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import repeat
+from typing import Callable, List, Dict, Any, Tuple, Optional, Set, NamedTuple, Union, FrozenSet
+from tree_sitter import Language, Parser, Node, Query, Tree # type: ignore
 from tree_sitter_languages import get_language
 
+from app.core.config import settings
+from .parse_cache import ParsedResultCache
+
 logger = logging.getLogger(__name__)
 
-# --- Data Structures (giữ nguyên) ---
+@lru_cache(maxsize=None)
+def _load_language(language_name: str) -> Language:
+    """Language của tree-sitter là immutable -> load một lần cho mỗi ngôn ngữ trong process."""
+    return get_language(language_name)
+
+# kind_id của node ERROR (ts_builtin_sym_error), giống nhau cho mọi grammar
+ERROR_KIND_ID = 0xFFFF
+
+@lru_cache(maxsize=None)
+def node_kind_ids(language_name: str, kind: str) -> FrozenSet[int]:
+    """
+    Tập kind_id (int) của các named node có tên `kind`, để so sánh Node.kind_id thay vì chuỗi Node.type.
+    Dựng từ node_kind_for_id vì Language.id_for_node_kind (0.21) crash với grammar của tree_sitter_languages.
+    """
+    lang = _load_language(language_name)
+    return frozenset(kind_id for kind_id in range(lang.node_kind_count)
+                     if lang.node_kind_is_named(kind_id) and lang.node_kind_for_id(kind_id) == kind)
+
+# Pool Parser theo thread: tree-sitter Parser không thread-safe nhưng tái sử dụng được cho nhiều file
+_PARSER_POOL = threading.local()
+
+def get_parser(language_name: str) -> Parser:
+    parsers: Optional[Dict[str, Parser]] = getattr(_PARSER_POOL, "parsers", None)
+    if parsers is None:
+        parsers = _PARSER_POOL.parsers = {}
+    parser = parsers.get(language_name)
+    if parser is None:
+        parser = Parser()
+        parser.set_language(_load_language(language_name))
+        parsers[language_name] = parser
+    return parser
+
+# Giá trị call_type / import_type dùng chung cho mọi entity (một object string duy nhất cho mỗi giá trị)
+CALL_TYPE_METHOD = sys.intern("method")
+CALL_TYPE_DIRECT = sys.intern("direct")
+CALL_TYPE_UNKNOWN = sys.intern("unknown")
+IMPORT_TYPE_DIRECT = sys.intern("direct")
+IMPORT_TYPE_DIRECT_ALIAS = sys.intern("direct_alias")
+IMPORT_TYPE_FROM = sys.intern("from")
+IMPORT_TYPE_FROM_WILDCARD = sys.intern("from_wildcard")
+SELF_NAME = sys.intern("self")
+
+# Text ngắn, ASCII (tên hàm/class/biến, "self"...) được intern trong _get_node_text: lặp lại hàng nghìn lần trong một repo
+INTERN_MAX_TEXT_LENGTH = 40
+
+# --- Data Structures ---
+# Dùng __slots__ vì mỗi file tạo ra hàng trăm/hàng nghìn object này (bỏ __dict__ cho mỗi instance).
 class ExtractedFunction:
+    __slots__ = ("name", "start_line", "end_line", "signature", "parameters_str", "class_name", "body_node", "calls")
+
     def __init__(self, name: str, start_line: int, end_line: int, signature: Optional[str] = None, class_name: Optional[str] = None, body_node: Optional[Node] = None, parameters_str: Optional[str] = None):
         self.name = name
         self.start_line = start_line
@@ -18,7 +80,17 @@ class ExtractedFunction:
         self.body_node = body_node
         self.calls: Set[Tuple[str, Optional[str], Optional[str], int]] = set()
 
+    def __getstate__(self):
+        # body_node (tree_sitter.Node) không pickle được và chỉ có nghĩa trong process đã parse ra nó
+        return {slot: (None if slot == "body_node" else getattr(self, slot)) for slot in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
 class ExtractedClass:
+    __slots__ = ("name", "start_line", "end_line", "body_node", "methods", "superclasses")
+
     def __init__(self, name: str, start_line: int, end_line: int, body_node: Optional[Node] = None):
         self.name = name
         self.start_line = start_line
@@ -27,13 +99,25 @@ class ExtractedClass:
         self.methods: List[ExtractedFunction] = []
         self.superclasses: Set[str] = set()
 
+    def __getstate__(self):
+        # body_node (tree_sitter.Node) không pickle được và chỉ có nghĩa trong process đã parse ra nó
+        return {slot: (None if slot == "body_node" else getattr(self, slot)) for slot in self.__slots__}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
 class ExtractedImport:
+    __slots__ = ("import_type", "module_path", "imported_names")
+
     def __init__(self, import_type: str, module_path: Optional[str] = None, imported_names: Optional[List[Tuple[str, Optional[str]]]] = None):
         self.import_type = import_type
         self.module_path = module_path
         self.imported_names = imported_names if imported_names else []
 
 class ParsedFileResult:
+    __slots__ = ("file_path", "language", "functions", "classes", "imports")
+
     def __init__(self, file_path: str, language: str):
         self.file_path = file_path
         self.language = language
@@ -41,39 +125,267 @@ class ParsedFileResult:
         self.classes: List[ExtractedClass] = []
         self.imports: List[ExtractedImport] = []
 
+class TreeEdit(NamedTuple):
+    """Một thay đổi trên source, theo đúng tham số của tree_sitter.Tree.edit (byte offset và (row, column))."""
+    start_byte: int
+    old_end_byte: int
+    new_end_byte: int
+    start_point: Tuple[int, int]
+    old_end_point: Tuple[int, int]
+    new_end_point: Tuple[int, int]
+
+    @classmethod
+    def from_sources(cls, old_source: bytes, new_source: bytes) -> Optional["TreeEdit"]:
+        """
+        Suy ra một TreeEdit bao phủ vùng khác nhau giữa hai phiên bản source
+        (phần đầu và phần cuối chung được giữ nguyên). Trả về None nếu hai source giống hệt nhau.
+        """
+        if old_source == new_source:
+            return None
+        max_common = min(len(old_source), len(new_source))
+        prefix_len = _common_length(lambda k: old_source[:k] == new_source[:k], max_common)
+        # Phần cuối chung không được chồng lên phần đầu chung
+        suffix_len = _common_length(
+            lambda k: old_source[len(old_source) - k:] == new_source[len(new_source) - k:], max_common - prefix_len
+        )
+        old_end_byte = len(old_source) - suffix_len
+        new_end_byte = len(new_source) - suffix_len
+        return cls(
+            prefix_len, old_end_byte, new_end_byte,
+            _byte_point(old_source, prefix_len), _byte_point(old_source, old_end_byte), _byte_point(new_source, new_end_byte)
+        )
+
+def _common_length(is_common: Callable[[int], bool], upper: int) -> int:
+    # Tìm nhị phân độ dài chung lớn nhất; mỗi bước so sánh slice bytes (memcmp trong C) thay vì lặp từng byte bằng Python
+    low, high = 0, upper
+    while low < high:
+        mid = (low + high + 1) // 2
+        if is_common(mid):
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+def _byte_point(source: bytes, byte_offset: int) -> Tuple[int, int]:
+    # (row, column) theo quy ước của tree-sitter: column tính bằng byte trong dòng
+    row = source.count(b"\n", 0, byte_offset)
+    return row, byte_offset - (source.rfind(b"\n", 0, byte_offset) + 1)
+
+class _ParseState(threading.local):
+    """Trạng thái của lần parse đang chạy. Riêng cho từng thread vì một instance parser được dùng chung giữa các thread."""
+
+    def __init__(self):
+        # memoryview trên source bytes của file đang parse; chỉ được set trong lúc parse()
+        self.source_view: Optional[memoryview] = None
+        # Byte range (đã sắp xếp) của các node ERROR ngoài cùng trong file đang parse
+        self.error_ranges: List[Tuple[int, int]] = []
+
 class BaseCodeParser:
-    def __init__(self, language_name: str):
+    # Số Tree giữ lại cho parse_incremental (LRU theo file_path) để cache không phình vô hạn
+    TREE_CACHE_SIZE = 1024
+    # File có hơn tỉ lệ byte này nằm trong node ERROR bị coi là hỏng quá nặng -> bỏ qua bước extract
+    MAX_ERROR_BYTE_RATIO = 0.3
+
+    def __init__(self, language_name: str, cache_path: Optional[str] = None):
         self.language_name = language_name
+        self._tree_cache: "OrderedDict[str, Tree]" = OrderedDict()
+        self._tree_cache_lock = threading.Lock()
+        # Cache kết quả parse theo hash nội dung; None = không cache
+        self._result_cache: Optional[ParsedResultCache] = None
+        if cache_path:
+            try:
+                self._result_cache = ParsedResultCache(cache_path, max_entries=settings.CKG_PARSE_CACHE_MAX_ENTRIES)
+            except sqlite3.Error as e: # Cache là tùy chọn: không mở được thì vẫn parse bình thường
+                logger.warning(f"CKG Parser: Could not open parse cache at {cache_path}, parsing without cache: {e}")
+        self._parse_state = _ParseState()
         try:
-            self.lang_object: Language = get_language(language_name)
-            self.parser: Parser = Parser()
-            self.parser.set_language(self.lang_object)
+            self.lang_object: Language = _load_language(language_name)
+            get_parser(language_name) # Khởi tạo sẵn Parser cho thread hiện tại (fail sớm nếu grammar lỗi)
             logger.info(f"Tree-sitter parser for '{language_name}' initialized successfully.")
         except Exception as e:
             logger.error(f"Failed to load tree-sitter language grammar for '{language_name}': {e}. ")
             raise ValueError(f"Could not initialize parser for {language_name}") from e
 
+    @property
+    def parser(self) -> Parser:
+        return get_parser(self.language_name)
+
+    @property
+    def _source_view(self) -> Optional[memoryview]:
+        return self._parse_state.source_view
+
+    @property
+    def _error_ranges(self) -> List[Tuple[int, int]]:
+        return self._parse_state.error_ranges
+
     def parse(self, code_content: str, file_path: str) -> Optional[ParsedFileResult]:
+        return self._parse_source(bytes(code_content, "utf8"), file_path)
+
+    def parse_file(self, file_path: str, file_path_in_repo: Optional[str] = None) -> Optional[ParsedFileResult]:
+        """
+        Parse file trực tiếp từ đĩa qua mmap (không đọc vào str rồi encode lại thành bytes).
+        file_path_in_repo: đường dẫn ghi vào kết quả (và dùng làm key cache); mặc định là file_path.
+        mmap bị đóng sau khi extract xong -> body_node trong kết quả không còn đọc được .text.
+        Giữ đúng kết quả như khi đọc file ở text mode trước đây:
+        - file không phải UTF-8 hợp lệ được đọc lại theo 'latin-1' để tên định danh không bị thay ký tự;
+        - xuống dòng CRLF và CR đơn lẻ được chuẩn hóa thành LF (universal newlines).
+        """
+        result_path = file_path_in_repo or file_path
+        try:
+            with open(file_path, "rb") as source_file:
+                if os.fstat(source_file.fileno()).st_size == 0: # mmap không map được file rỗng
+                    return self._parse_source(b"", result_path)
+                source_map = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logger.error(f"CKG Parser: Could not read file {file_path}: {e}")
+            return None
+        try:
+            source: Union[bytes, mmap.mmap] = source_map
+            try:
+                # Chỉ để kiểm tra UTF-8 hợp lệ, str tạo ra bị bỏ ngay. Decoder UTF-8 của CPython có fast path cho ASCII
+                # (~30µs/600KB, ~0.6ms nếu có ký tự ngoài ASCII) -> không đáng kể so với tree-sitter parse (~70ms/600KB)
+                str(source_map, "utf8")
+            except UnicodeDecodeError:
+                logger.warning(f"CKG Parser: UTF-8 decode error for {result_path}. Falling back to 'latin-1'.")
+                source = str(source_map, "latin-1").encode("utf8")
+            if source.find(b"\r") != -1:
+                # Chỉ copy khi file thực sự có \r; bytes(bytes) không copy
+                source = bytes(source).replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            return self._parse_source(source, result_path)
+        finally:
+            source_map.close()
+
+    def parse_incremental(self, new_code: str, file_path: str, old_tree: Optional[Tree] = None,
+                          edits: Optional[List[TreeEdit]] = None, old_code: Optional[str] = None) -> Optional[ParsedFileResult]:
+        """
+        Parse lại file sau khi bị sửa, tái sử dụng các subtree không đổi của tree cũ.
+        Nếu không truyền old_tree thì dùng tree lần trước của file_path (nếu còn trong cache).
+        Nếu không truyền edits nhưng có old_code (nội dung ứng với tree cũ), edit được suy ra bằng TreeEdit.from_sources.
+        Không có tree cũ hoặc không có edits -> parse toàn bộ như parse().
+        """
+        new_source = bytes(new_code, "utf8")
+        if old_tree is None:
+            # Lấy tree ra khỏi cache: Tree.edit() sửa tại chỗ, hai thread không được cùng sửa một tree
+            with self._tree_cache_lock:
+                old_tree = self._tree_cache.pop(file_path, None)
+        if old_tree is not None and edits is None and old_code is not None:
+            diff_edit = TreeEdit.from_sources(bytes(old_code, "utf8"), new_source)
+            edits = [diff_edit] if diff_edit else None
+        if old_tree is not None and edits:
+            for edit in edits:
+                old_tree.edit(**edit._asdict())
+        else:
+            old_tree = None
+        return self._parse_source(new_source, file_path, old_tree=old_tree, remember_tree=True)
+
+    def _remember_tree(self, file_path: str, tree: Tree) -> None:
+        with self._tree_cache_lock:
+            self._tree_cache[file_path] = tree
+            self._tree_cache.move_to_end(file_path)
+            if len(self._tree_cache) > self.TREE_CACHE_SIZE:
+                self._tree_cache.popitem(last=False)
+
+    def _parse_source(self, source_bytes: Union[bytes, mmap.mmap], file_path: str, old_tree: Optional[Tree] = None,
+                      remember_tree: bool = False) -> Optional[ParsedFileResult]:
+        parse_state = self._parse_state
         if not self.parser or not self.lang_object:
             logger.error(f"Parser for {self.language_name} not properly initialized for file {file_path}.")
             return None
         try:
-            tree = self.parser.parse(bytes(code_content, "utf8"))
+            content_sha: Optional[bytes] = None
+            if self._result_cache:
+                content_sha = ParsedResultCache.content_key(self.language_name, source_bytes)
+                cached_result = self._result_cache.get(file_path, content_sha)
+                if cached_result is not None:
+                    logger.debug("CKG Parser: Cache hit for %s, skipping parse.", file_path)
+                    # Tree cũ (nếu có) không còn khớp với nội dung hiện tại
+                    with self._tree_cache_lock:
+                        self._tree_cache.pop(file_path, None)
+                    return cached_result
+            tree = self.parser.parse(source_bytes, old_tree) if old_tree is not None else self.parser.parse(source_bytes)
+            if remember_tree:
+                self._remember_tree(file_path, tree)
             result = ParsedFileResult(file_path=file_path, language=self.language_name)
             if tree.root_node.has_error:
-                logger.warning(f"Syntax errors found in file {file_path} during parsing. CKG data might be incomplete.")
+                max_error_bytes = self.MAX_ERROR_BYTE_RATIO * len(source_bytes)
+                error_node, parse_state.error_ranges = self._scan_syntax_errors(tree, max_error_bytes)
+                error_location = f" (first error at line {error_node.start_point[0] + 1}, column {error_node.start_point[1] + 1})" if error_node else ""
+                logger.warning(f"Syntax errors found in file {file_path} during parsing{error_location}. CKG data might be incomplete.")
+                error_bytes = sum(end_byte - start_byte for start_byte, end_byte in parse_state.error_ranges)
+                if error_bytes > max_error_bytes:
+                    logger.warning(f"CKG Parser: More than {self.MAX_ERROR_BYTE_RATIO:.0%} of {file_path} is inside syntax errors. Skipping entity extraction for this file.")
+                    return result
+            parse_state.source_view = memoryview(source_bytes)
             self._extract_entities(tree.root_node, result)
+            if self._result_cache and content_sha is not None:
+                self._result_cache.put(file_path, content_sha, result)
             return result
         except Exception as e:
             logger.error(f"Error parsing file {file_path} with {self.language_name} parser: {e}", exc_info=True)
             return None
+        finally:
+            parse_state.error_ranges = []
+            if parse_state.source_view is not None:
+                parse_state.source_view.release()
+                parse_state.source_view = None
+
+    @staticmethod
+    def _scan_syntax_errors(tree: Tree, max_error_bytes: Optional[float] = None) -> Tuple[Optional[Node], List[Tuple[int, int]]]:
+        """
+        Một lượt TreeCursor phía C (không đệ quy Python) qua các subtree có lỗi.
+        Trả về node ERROR/MISSING đầu tiên (pre-order) và byte range của các node ERROR ngoài cùng, theo thứ tự.
+        Dừng sớm khi tổng số byte lỗi vượt max_error_bytes (khi đó danh sách range không đầy đủ).
+        """
+        first_error_node: Optional[Node] = None
+        error_ranges: List[Tuple[int, int]] = []
+        error_bytes = 0
+        cursor = tree.walk()
+        while True:
+            node = cursor.node
+            is_error = node.kind_id == ERROR_KIND_ID
+            if is_error or node.is_missing:
+                if first_error_node is None: first_error_node = node
+                if is_error:
+                    error_ranges.append((node.start_byte, node.end_byte))
+                    error_bytes += node.end_byte - node.start_byte
+                    if max_error_bytes is not None and error_bytes > max_error_bytes:
+                        return first_error_node, error_ranges
+            # Chỉ đi xuống subtree có lỗi (và không đi vào bên trong node ERROR)
+            elif node.has_error and cursor.goto_first_child():
+                continue
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return first_error_node, error_ranges
+
+    @staticmethod
+    def _find_first_error_node(tree: Tree) -> Optional[Node]:
+        return BaseCodeParser._scan_syntax_errors(tree)[0]
+
+    def _is_inside_syntax_error(self, node: Node) -> bool:
+        error_ranges = self._parse_state.error_ranges
+        if not error_ranges:
+            return False
+        index = bisect_right(error_ranges, (node.start_byte, float("inf"))) - 1
+        return index >= 0 and node.end_byte <= error_ranges[index][1]
 
     def _extract_entities(self, root_node: Node, result: ParsedFileResult):
         raise NotImplementedError("Subclasses must implement _extract_entities")
 
     def _get_node_text(self, node: Optional[Node]) -> Optional[str]:
-        return node.text.decode('utf8') if node else None
-
+        if not node:
+            return None
+        source_view = self._parse_state.source_view
+        if source_view is None: # Gọi ngoài parse(): fallback về node.text
+            text = node.text.decode('utf8')
+        else:
+            # Slice memoryview không copy bytes; decode trực tiếp từ buffer của source.
+            # 'replace': file đọc qua parse_file() có thể không phải UTF-8 hợp lệ
+            text = str(source_view[node.start_byte:node.end_byte], 'utf8', 'replace')
+        if len(text) <= INTERN_MAX_TEXT_LENGTH and text.isascii():
+            return sys.intern(text)
+        return text
+
+    # Helper cho caller bên ngoài; các vòng lặp extract đọc trực tiếp node.start_point/end_point
     def _get_line_number(self, node: Node) -> int:
         return node.start_point[0] + 1
 
@@ -81,281 +393,348 @@ class BaseCodeParser:
         return node.end_point[0] + 1
 
 class PythonParser(BaseCodeParser):
-    def __init__(self):
-        super().__init__("python")
-        self.queries = {
-            "imports": self.lang_object.query("""
-                (import_statement
-                  name: [
-                    (dotted_name) @module_path
-                    (aliased_import name: (dotted_name) @module_path alias: (identifier) @alias)
-                  ]
-                ) @import_direct_statement
-
-                (import_from_statement
-                  module_name: (dotted_name)? @from_module_path
-                  name: [
-                    (wildcard_import) @wildcard
-                    (dotted_name) @imported_name
-                    (aliased_import name: (dotted_name) @imported_name alias: (identifier) @imported_alias)
-                  ]
-                ) @import_from_statement
-            """),
-            "classes": self.lang_object.query("""
-                (class_definition
-                    name: (identifier) @class.name
-                    superclasses: (argument_list . (_) @superclass)?
-                    body: (block) @class.body
-                ) @class.definition
-            """),
-            "functions_and_methods": self.lang_object.query("""
-                (function_definition
-                    name: (identifier) @function.name
-                    parameters: (parameters) @function.parameters
-                    return_type: (type)? @function.return_type
-                    body: (block) @function.body
-                ) @function.definition
-            """),
-            "calls": self.lang_object.query("""
-                (call
-                    function: [
-                        (identifier) @func_name_direct
-                        (attribute object: (identifier) @obj_name attribute: (identifier) @method_name)
-                        (attribute object: (call) @chained_call_obj attribute: (identifier) @method_name)
-                        (attribute object: (subscript) @subscript_obj attribute: (identifier) @method_name)
-                        (attribute object: (attribute) @nested_attr_obj attribute: (identifier) @method_name)
-                    ]
-                    arguments: (_)? @arguments
-                ) @call_expression
-            """)
-        }
+    # Các pattern của query "entities" (import/class/function/call), gộp lại để chạy một lần duy nhất trên toàn file.
+    # Thứ tự tuple = pattern index mà Query.matches() trả về -> dùng để dispatch match, không cần dò capture.
+    # Mỗi phần tử: (loại entity, capture chính của pattern, pattern)
+    ENTITY_PATTERNS: Tuple[Tuple[str, str, str], ...] = (
+        ("import", "import_direct_statement", """
+            (import_statement
+              name: [
+                (dotted_name) @module_path
+                (aliased_import name: (dotted_name) @module_path alias: (identifier) @alias)
+              ]
+            ) @import_direct_statement
+        """),
+        ("import", "import_from_statement", """
+            (import_from_statement
+              module_name: [
+                (dotted_name) @from_module_path
+                (relative_import)
+              ]?
+              name: [
+                (wildcard_import) @wildcard
+                (dotted_name) @imported_name
+                (aliased_import name: (dotted_name) @imported_name alias: (identifier) @imported_alias)
+              ]
+            ) @import_from_statement
+        """),
+        ("class", "class.definition", """
+            (class_definition
+                name: (identifier) @class.name
+                superclasses: (argument_list . (_) @superclass)?
+                body: (block) @class.body
+            ) @class.definition
+        """),
+        ("function", "function.definition", """
+            (function_definition
+                name: (identifier) @function.name
+                parameters: (parameters) @function.parameters
+                return_type: (type)? @function.return_type
+                body: (block) @function.body
+            ) @function.definition
+        """),
+        ("call", "call_expression", """
+            (call
+                function: [
+                    (identifier) @func_name_direct
+                    (attribute object: (identifier) @obj_name attribute: (identifier) @method_name)
+                    (attribute object: (call) @chained_call_obj attribute: (identifier) @method_name)
+                    (attribute object: (subscript) @subscript_obj attribute: (identifier) @method_name)
+                    (attribute object: (attribute) @nested_attr_obj attribute: (identifier) @method_name)
+                ]
+                arguments: (_)? @arguments
+            ) @call_expression
+        """),
+    )
+    ENTITY_PATTERN_KINDS: Tuple[Tuple[str, str], ...] = tuple((kind, main_capture) for kind, main_capture, _ in ENTITY_PATTERNS)
+
+    QUERY_DEFINITIONS: Dict[str, str] = {
+        "entities": "".join(pattern for _, _, pattern in ENTITY_PATTERNS),
+    }
+
+    # Query đã compile, dùng chung cho mọi instance (key: id của Language object)
+    _QUERY_CACHE: Dict[int, Dict[str, Query]] = {}
+    # Parser có thể được tạo đồng thời từ nhiều thread (run_in_executor) -> chỉ một thread compile query
+    _QUERY_CACHE_LOCK = threading.Lock()
+
+    @classmethod
+    def _compiled_queries(cls, lang_object: Language) -> Dict[str, Query]:
+        compiled = cls._QUERY_CACHE.get(id(lang_object))
+        if compiled is None:
+            with cls._QUERY_CACHE_LOCK:
+                compiled = cls._QUERY_CACHE.get(id(lang_object))
+                if compiled is None:
+                    compiled = {name: lang_object.query(query_string) for name, query_string in cls.QUERY_DEFINITIONS.items()}
+                    cls._QUERY_CACHE[id(lang_object)] = compiled
+        return compiled
+
+    def __init__(self, cache_path: Optional[str] = None):
+        super().__init__("python", cache_path=cache_path)
+        self.queries = type(self)._compiled_queries(self.lang_object)
+        # So sánh kind_id (int) thay vì Node.type (mỗi lần đọc tạo một str mới từ C)
+        self._function_definition_kinds = node_kind_ids("python", "function_definition")
+        self._block_kinds = node_kind_ids("python", "block")
         logger.info("PythonParser initialized.")
 
-    def _process_match_item(self, query_obj: Query, match_as_tuple: Any,
-                                main_capture_names_without_at: List[str]) -> Tuple[Optional[Node], Dict[str, List[Node]]]:
-        """
-        Helper to process captures from a match item.
-        Assumes match_as_tuple is a tuple: (pattern_index, dict_of_captures).
-        dict_of_captures maps capture_name (e.g. "module_path" or "@module_path") to List[Node] or a single Node.
-        main_capture_names_without_at should be like ["import_direct_statement"] (no '@').
-        Returns:
-            - main_node: The first node associated with any name in main_capture_names_without_at.
-            - validated_captures_map: A dict where keys are capture names *without* '@' prefix,
-                                      and values are always List[Node].
-        """
-        if not (isinstance(match_as_tuple, tuple) and len(match_as_tuple) == 2):
-            logger.warning(f"CKG Parser: Item from 'matches' iterator is not a 2-element tuple: type {type(match_as_tuple)}, len {len(match_as_tuple) if isinstance(match_as_tuple, tuple) else 'N/A'}. Skipping.")
-            return None, {}
-
-        _pattern_index = match_as_tuple[0]
-        captures_map_from_iterator = match_as_tuple[1]
-
-        if not isinstance(captures_map_from_iterator, dict):
-            logger.error(f"CKG Parser: Second element of match tuple is not a dict as expected, got {type(captures_map_from_iterator)}. This suggests an issue with tree-sitter's output interpretation. Skipping match.")
-            return None, {}
-
-        main_node: Optional[Node] = None
-        validated_captures_map: Dict[str, List[Node]] = {}
-
-        for raw_capture_key, captured_value in captures_map_from_iterator.items():
-            if not isinstance(raw_capture_key, str):
-                logger.warning(f"CKG Parser: Invalid capture key type '{type(raw_capture_key)}'. Expected string. Skipping.")
+    # Lưu ý: captures dict của Query.matches() (tree-sitter 0.21) map tên capture (không có '@') -> Node;
+    # chỉ capture có quantifier (*, +) mới trả về list, và các query ở đây không dùng quantifier.
+
+    def _from_module_path(self, captures_dict: Dict[str, Node]) -> Optional[str]:
+        # Relative import (`from . import x`, `from ..pkg import y`) -> module_path None: đường dẫn "." / "..pkg"
+        # không định danh được module nếu không biết package của file, builder sẽ bỏ qua node Module cho import này
+        return self._get_node_text(captures_dict.get("from_module_path"))
+
+    def _extract_imports(self, import_matches: List[Dict[str, Node]], result: ParsedFileResult):
+        get_text = self._get_node_text
+        # Mỗi tên trong `from x import a, b as c` là một match riêng -> gom theo statement
+        from_imports_by_statement_id: Dict[int, ExtractedImport] = {}
+        extracted_imports: List[ExtractedImport] = []
+
+        for captures_dict in import_matches:
+            from_statement_node = captures_dict.get("import_from_statement")
+            if from_statement_node is not None and "wildcard" not in captures_dict:
+                imported_name = get_text(captures_dict.get("imported_name"))
+                if not imported_name: continue
+                alias_name = get_text(captures_dict.get("imported_alias"))
+
+                from_import = from_imports_by_statement_id.get(from_statement_node.id)
+                if from_import is None:
+                    from_import = ExtractedImport(IMPORT_TYPE_FROM, self._from_module_path(captures_dict), [])
+                    from_imports_by_statement_id[from_statement_node.id] = from_import
+                    extracted_imports.append(from_import)
+                from_import.imported_names.append((imported_name, alias_name))
                 continue
 
-            nodes_list_for_key: List[Node] = []
-            if isinstance(captured_value, Node): # If it's a single Node, wrap it in a list
-                nodes_list_for_key = [captured_value]
-            elif isinstance(captured_value, list) and all(isinstance(n, Node) for n in captured_value): # If it's already a list of Nodes
-                nodes_list_for_key = captured_value
-            else: # Unexpected type for captured_value
-                logger.warning(f"CKG Parser: Value for capture key '{raw_capture_key}' is not a Node or List[Node]. Got type {type(captured_value)}. Skipping this capture entry.")
-                continue 
-            
-            normalized_key = raw_capture_key[1:] if raw_capture_key.startswith('@') else raw_capture_key
-            validated_captures_map[normalized_key] = nodes_list_for_key
-            
-            if main_capture_names_without_at and normalized_key in main_capture_names_without_at:
-                if nodes_list_for_key: 
-                    if main_node is None:
-                        main_node = nodes_list_for_key[0]
-        
-        if main_capture_names_without_at and not main_node:
-             logger.debug(f"CKG Parser: Main node not found for specified main_capture_names: {main_capture_names_without_at} in captures: {list(validated_captures_map.keys())}")
+            # Mỗi match của `import a, b as c` ứng với đúng một tên -> mỗi tên là một ExtractedImport riêng
+            if from_statement_node is None:
+                module_path_text = get_text(captures_dict.get("module_path"))
+                alias_text = get_text(captures_dict.get("alias"))
+                if alias_text and module_path_text:
+                     extracted_imports.append(ExtractedImport(IMPORT_TYPE_DIRECT_ALIAS, module_path_text, [(module_path_text, alias_text)]))
+                elif module_path_text:
+                    extracted_imports.append(ExtractedImport(IMPORT_TYPE_DIRECT, module_path_text, [(module_path_text, None)]))
+            else: # Chỉ còn trường hợp wildcard
+                extracted_imports.append(ExtractedImport(IMPORT_TYPE_FROM_WILDCARD, self._from_module_path(captures_dict), [("*", None)]))
 
-        return main_node, validated_captures_map
+        result.imports.extend(extracted_imports)
 
-    def _extract_imports(self, root_node: Node, result: ParsedFileResult):
-        query_obj = self.queries["imports"]
-        processed_statement_node_ids = set()
-
-        for match_as_tuple in query_obj.matches(root_node):
-            main_statement_node, captures_dict = self._process_match_item(
-                query_obj, match_as_tuple, ["import_direct_statement", "import_from_statement"]
-            )
-            if not main_statement_node: continue
-            if main_statement_node.id in processed_statement_node_ids: continue
-            processed_statement_node_ids.add(main_statement_node.id)
-
-            if main_statement_node.type == "import_statement":
-                module_path_nodes = captures_dict.get("module_path", [])
-                alias_nodes = captures_dict.get("alias", [])
-                if module_path_nodes: # Ensure list is not empty
-                    module_path_text = self._get_node_text(module_path_nodes[0])
-                    alias_text = self._get_node_text(alias_nodes[0]) if alias_nodes else None
-                    if alias_text and module_path_text:
-                         result.imports.append(ExtractedImport("direct_alias", module_path_text, [(module_path_text, alias_text)]))
-                    elif module_path_text:
-                        result.imports.append(ExtractedImport("direct", module_path_text, [(module_path_text, None)]))
-
-            elif main_statement_node.type == "import_from_statement":
-                from_module_path_node_list = captures_dict.get("from_module_path", [])
-                from_module_path_text = self._get_node_text(from_module_path_node_list[0]) if from_module_path_node_list else None
-                
-                if "wildcard" in captures_dict:
-                    result.imports.append(ExtractedImport("from_wildcard", from_module_path_text, [("*", None)]))
-                else:
-                    imported_items_from: List[Tuple[str, Optional[str]]] = []
-                    name_field_container_node = main_statement_node.child_by_field_name('name')
-                    if name_field_container_node:
-                        for item_node in name_field_container_node.named_children:
-                            if item_node.type == "dotted_name":
-                                imported_name = self._get_node_text(item_node)
-                                if imported_name: imported_items_from.append((imported_name, None))
-                            elif item_node.type == "aliased_import":
-                                original_name_node = item_node.child_by_field_name("name")
-                                alias_node = item_node.child_by_field_name("alias")
-                                if original_name_node and alias_node:
-                                    original_name, alias_name = self._get_node_text(original_name_node), self._get_node_text(alias_node)
-                                    if original_name: imported_items_from.append((original_name, alias_name))
-                    if imported_items_from:
-                         result.imports.append(ExtractedImport("from", from_module_path_text, imported_items_from))
-
-    def _extract_calls(self, scope_node: Node, current_owner_entity: ExtractedFunction, result: ParsedFileResult):
-        if not scope_node: return
-        query_obj_calls = self.queries["calls"]
-        for match_as_tuple in query_obj_calls.matches(scope_node):
-            call_expression_node, captures_dict = self._process_match_item(
-                query_obj_calls, match_as_tuple, ["call_expression"]
-            )
-            if not call_expression_node: continue
-
-            call_name_node_list = captures_dict.get("func_name_direct", [])
-            obj_name_node_list = captures_dict.get("obj_name", [])
-            method_name_node_list = captures_dict.get("method_name", [])
-
-            call_name_node = call_name_node_list[0] if call_name_node_list else None
-            obj_name_node = obj_name_node_list[0] if obj_name_node_list else None
-            method_name_node = method_name_node_list[0] if method_name_node_list else None
-            
-            call_type, called_name_str, base_object_name_str = "unknown", None, None
+    def _extract_calls(self, call_matches: List[Dict[str, Node]], functions: List[ExtractedFunction]):
+        """
+        Gán mỗi call (match của query "entities" trên toàn file) cho mọi function có body chứa nó
+        (giống như khi query trên subtree của từng body: call trong method của class lồng trong function
+        cũng thuộc về function bên ngoài).
+        """
+        if not functions: return
+        # Body của các function đã extract hoặc lồng nhau hoặc rời nhau -> sắp theo byte bắt đầu,
+        # enclosing_index[i] là function gần nhất chứa body i (-1 nếu không có)
+        ordered_functions = sorted(functions, key=lambda func: func.body_node.start_byte)
+        body_starts = [func.body_node.start_byte for func in ordered_functions]
+        body_ends = [func.body_node.end_byte for func in ordered_functions]
+        enclosing_index: List[int] = []
+        open_bodies: List[int] = []
+        for index, body_start in enumerate(body_starts):
+            while open_bodies and body_ends[open_bodies[-1]] <= body_start: open_bodies.pop()
+            enclosing_index.append(open_bodies[-1] if open_bodies else -1)
+            open_bodies.append(index)
+        calls_adds = [func.calls.add for func in ordered_functions]
+
+        get_text, source_view = self._get_node_text, self._source_view
+        for captures_dict in call_matches:
+            call_expression_node = captures_dict["call_expression"]
+
+            call_start = call_expression_node.start_byte
+            owner_index = bisect_right(body_starts, call_start) - 1
+            while owner_index >= 0 and body_ends[owner_index] <= call_start:
+                owner_index = enclosing_index[owner_index]
+            if owner_index < 0: continue # Call ở cấp module, không thuộc function nào
+
+            method_name_node = captures_dict.get("method_name")
+            call_type, called_name_str, base_object_name_str = CALL_TYPE_UNKNOWN, None, None
             if method_name_node:
-                call_type, called_name_str = "method", self._get_node_text(method_name_node)
-                if obj_name_node: base_object_name_str = self._get_node_text(obj_name_node)
-            elif call_name_node: 
-                call_type, called_name_str = "direct", self._get_node_text(call_name_node)
-            
-            if called_name_str:
-                current_owner_entity.calls.add(
-                    (called_name_str, base_object_name_str, call_type, self._get_line_number(call_expression_node))
-                )
-
-    def _extract_functions_and_methods(self, scope_node: Node, result: ParsedFileResult, current_class_obj: Optional[ExtractedClass] = None):
-        if not scope_node: return
-        query_obj_funcs = self.queries["functions_and_methods"]
-        for match_as_tuple in query_obj_funcs.matches(scope_node):
-            func_def_node, captures_dict = self._process_match_item(
-                query_obj_funcs, match_as_tuple, ["function.definition"]
+                call_type, called_name_str = CALL_TYPE_METHOD, get_text(method_name_node)
+                obj_name_node = captures_dict.get("obj_name")
+                if obj_name_node:
+                    # `self.method()` chiếm phần lớn method call -> so sánh byte, không decode
+                    obj_start, obj_end = obj_name_node.start_byte, obj_name_node.end_byte
+                    if obj_end - obj_start == 4 and source_view[obj_start:obj_end] == b"self":
+                        base_object_name_str = SELF_NAME
+                    else:
+                        base_object_name_str = get_text(obj_name_node)
+            else:
+                call_name_node = captures_dict.get("func_name_direct")
+                if call_name_node: call_type, called_name_str = CALL_TYPE_DIRECT, get_text(call_name_node)
+            if not called_name_str: continue
+
+            call_info = (called_name_str, base_object_name_str, call_type, call_expression_node.start_point[0] + 1)
+            while owner_index >= 0:
+                calls_adds[owner_index](call_info)
+                owner_index = enclosing_index[owner_index]
+
+    def _extract_functions_and_methods(self, function_matches: List[Dict[str, Node]], root_node: Node, result: ParsedFileResult,
+                                       classes_by_body_id: Dict[int, ExtractedClass]) -> List[ExtractedFunction]:
+        get_text = self._get_node_text
+        # Global function: con trực tiếp của module (hoặc của block ngay dưới module) -> tính tập id một lần
+        global_function_ids: Set[int] = set()
+        function_kinds, block_kinds = self._function_definition_kinds, self._block_kinds
+        for child in root_node.children:
+            child_kind = child.kind_id
+            if child_kind in function_kinds: global_function_ids.add(child.id)
+            elif child_kind in block_kinds:
+                global_function_ids.update(grandchild.id for grandchild in child.children if grandchild.kind_id in function_kinds)
+
+        extracted_funcs: List[ExtractedFunction] = []
+        for captures_dict in function_matches:
+            func_def_node = captures_dict.get("function.definition")
+            if func_def_node is None: continue
+
+            # Method: parent là body của một class -> tra dict theo id của body
+            owner_class: Optional[ExtractedClass] = None
+            if func_def_node.id not in global_function_ids:
+                parent_node = func_def_node.parent
+                owner_class = classes_by_body_id.get(parent_node.id) if parent_node is not None else None
+                if owner_class is None: continue
+
+            func_name = get_text(captures_dict.get("function.name"))
+            if not func_name: continue
+            params_str = get_text(captures_dict.get("function.parameters")) or ""
+            return_type_str = get_text(captures_dict.get("function.return_type"))
+            func_body_node = captures_dict.get("function.body")
+
+            # Text của node lấy đúng theo byte range của token nên không có khoảng trắng ở hai đầu -> không cần strip()
+            signature = f"{params_str} -> {return_type_str}" if return_type_str else params_str
+            # Positional args: (name, start_line, end_line, signature, class_name, body_node, parameters_str)
+            func_obj = ExtractedFunction(
+                func_name, func_def_node.start_point[0] + 1, func_def_node.end_point[0] + 1,
+                signature, owner_class.name if owner_class else None, func_body_node, params_str
             )
-            if not func_def_node: continue
-
-            is_valid_scope = False
-            if current_class_obj:
-                if func_def_node.parent == scope_node: is_valid_scope = True
-            else: 
-                if func_def_node.parent == scope_node or \
-                   (func_def_node.parent and func_def_node.parent.type == 'block' and func_def_node.parent.parent == scope_node):
-                    is_valid_scope = True
-            if not is_valid_scope: continue
-
-            func_name_node_list = captures_dict.get("function.name", [])
-            func_name = self._get_node_text(func_name_node_list[0]) if func_name_node_list else None
-
-            params_node_list = captures_dict.get("function.parameters", [])
-            params_str = self._get_node_text(params_node_list[0]) if params_node_list else ""
-            
-            return_type_node_list = captures_dict.get("function.return_type", [])
-            return_type_str = self._get_node_text(return_type_node_list[0]) if return_type_node_list else None
-            
-            func_body_node_list = captures_dict.get("function.body", [])
-            func_body_node = func_body_node_list[0] if func_body_node_list else None
-            
-            if func_name:
-                signature = f"{params_str}" + (f" -> {return_type_str}" if return_type_str else "")
-                func_obj = ExtractedFunction(
-                    name=func_name, start_line=self._get_line_number(func_def_node),
-                    end_line=self._get_end_line_number(func_def_node), signature=signature.strip(),
-                    parameters_str=params_str.strip(), class_name=current_class_obj.name if current_class_obj else None,
-                    body_node=func_body_node
-                )
-                self._extract_calls(func_body_node, func_obj, result)
-                if current_class_obj: current_class_obj.methods.append(func_obj)
-                else: result.functions.append(func_obj)
-
-    def _extract_classes(self, root_node: Node, result: ParsedFileResult):
-        query_obj_classes = self.queries["classes"]
-        for match_as_tuple in query_obj_classes.matches(root_node):
-            class_def_node, captures_dict = self._process_match_item(
-                query_obj_classes, match_as_tuple, ["class.definition"]
+            extracted_funcs.append(func_obj)
+            if owner_class: owner_class.methods.append(func_obj)
+            else: result.functions.append(func_obj)
+        return extracted_funcs
+
+    def _extract_classes(self, class_matches: List[Dict[str, Node]], result: ParsedFileResult) -> Dict[int, ExtractedClass]:
+        get_text = self._get_node_text
+        classes_by_body_id: Dict[int, ExtractedClass] = {}
+        for captures_dict in class_matches:
+            class_def_node = captures_dict.get("class.definition")
+            class_body_node = captures_dict.get("class.body")
+            if class_def_node is None or class_body_node is None: continue
+            class_name = get_text(captures_dict.get("class.name"))
+            if not class_name: continue
+
+            superclass_text = get_text(captures_dict.get("superclass"))
+            superclasses_set: Set[str] = {superclass_text} if superclass_text else set()
+
+            class_obj = ExtractedClass(
+                name=class_name, start_line=class_def_node.start_point[0] + 1,
+                end_line=class_def_node.end_point[0] + 1, body_node=class_body_node
             )
-            if not class_def_node: continue
-
-            class_name_node_list = captures_dict.get("class.name", [])
-            class_name = self._get_node_text(class_name_node_list[0]) if class_name_node_list else None
-            
-            class_body_node_list = captures_dict.get("class.body", [])
-            class_body_node = class_body_node_list[0] if class_body_node_list else None
-            
-            superclasses_set: Set[str] = set()
-            for sc_node in captures_dict.get("superclass", []): # Iterates list of nodes for "superclass"
-                sc_text = self._get_node_text(sc_node)
-                if sc_text: superclasses_set.add(sc_text)
-            
-            if class_name and class_body_node:
-                class_obj = ExtractedClass(
-                    name=class_name, start_line=self._get_line_number(class_def_node),
-                    end_line=self._get_end_line_number(class_def_node), body_node=class_body_node
-                )
-                class_obj.superclasses = superclasses_set
-                self._extract_functions_and_methods(class_body_node, result, class_obj)
-                result.classes.append(class_obj)
+            class_obj.superclasses = superclasses_set
+            classes_by_body_id[class_body_node.id] = class_obj
+            result.classes.append(class_obj)
+        return classes_by_body_id
 
     def _extract_entities(self, root_node: Node, result: ParsedFileResult):
-        self._extract_imports(root_node, result) 
-        self._extract_classes(root_node, result)
-        self._extract_functions_and_methods(root_node, result, current_class_obj=None)
+        # Một lần chạy query "entities" trên toàn file, chia match theo pattern index.
+        # Class được xử lý trước function để method luôn tìm được class chứa nó; call được gán sau cùng.
+        matches_by_kind: Dict[str, List[Dict[str, Node]]] = {"import": [], "class": [], "function": [], "call": []}
+        pattern_kinds = self.ENTITY_PATTERN_KINDS
+        # Match nằm trong node ERROR là kết quả error-recovery của tree-sitter, không phải code thật -> bỏ qua
+        is_inside_error = self._is_inside_syntax_error if self._error_ranges else None
+        for pattern_index, captures_dict in self.queries["entities"].matches(root_node):
+            kind, main_capture = pattern_kinds[pattern_index]
+            if is_inside_error and is_inside_error(captures_dict[main_capture]): continue
+            matches_by_kind[kind].append(captures_dict)
+
+        self._extract_imports(matches_by_kind["import"], result)
+        classes_by_body_id = self._extract_classes(matches_by_kind["class"], result)
+        extracted_funcs = self._extract_functions_and_methods(matches_by_kind["function"], root_node, result, classes_by_body_id)
+        self._extract_calls(matches_by_kind["call"], extracted_funcs)
         
-        logger.debug(
-            f"PythonParser Extracted from {result.file_path}: "
-            f"{len(result.imports)} imports, "
-            f"{len(result.classes)} classes ("
-            f"{sum(len(c.methods) for c in result.classes)} methods), "
-            f"{len(result.functions)} global functions."
-        )
+        # Chỉ tính thống kê khi debug log thực sự được bật (hàm này chạy cho mọi file)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "PythonParser Extracted from %s: %d imports, %d classes (%d methods), %d global functions.",
+                result.file_path, len(result.imports), len(result.classes),
+                sum(len(c.methods) for c in result.classes), len(result.functions)
+            )
+
+@lru_cache(maxsize=None)
+def _make_parser(language_key: str) -> Optional[BaseCodeParser]:
+    # Một parser cho mỗi ngôn ngữ trong process; None cũng được cache nên warning chỉ log một lần
+    if language_key == "python":
+        return PythonParser(cache_path=settings.CKG_PARSE_CACHE_PATH)
+    logger.warning(f"No specific parser class implemented for language: '{language_key}'. Tree-sitter grammar might be available but entities won't be extracted.")
+    return None
 
-_parsers_cache = {}
 def get_code_parser(language: str) -> Optional[BaseCodeParser]:
     language_key = language.lower().strip()
     if not language_key:
         return None
-    if language_key in _parsers_cache:
-        return _parsers_cache[language_key]
+    return _make_parser(language_key)
 
-    parser_instance: Optional[BaseCodeParser] = None
-    if language_key == "python":
-        parser_instance = PythonParser()
-    else:
-        logger.warning(f"No specific parser class implemented for language: '{language}'. Tree-sitter grammar might be available but entities won't be extracted.")
-    
-    if parser_instance:
-        _parsers_cache[language_key] = parser_instance
-    return parser_instance
\ No newline at end of file
+def _init_parse_worker(language: str) -> None:
+    # Tạo sẵn parser (grammar + query đã compile) một lần khi worker khởi động, trước khi nhận file đầu tiên
+    get_code_parser(language)
+
+def _parse_file_in_worker(file_path: str, language: str, root_dir: Optional[str]) -> Optional[ParsedFileResult]:
+    parser = get_code_parser(language)
+    if not parser:
+        return None
+    if root_dir:
+        return parser.parse_file(os.path.join(root_dir, file_path), file_path)
+    return parser.parse_file(file_path)
+
+def parse_many(file_paths: List[str], language: str, max_workers: Optional[int] = None,
+               root_dir: Optional[str] = None, chunksize: int = 16) -> List[Optional[ParsedFileResult]]:
+    """
+    Parse nhiều file song song bằng process pool (mỗi worker dùng lại parser/query đã cache của nó).
+    Nếu có root_dir, file_paths là đường dẫn tương đối so với root_dir và được giữ nguyên trong kết quả.
+    Kết quả trả về theo đúng thứ tự của file_paths; None cho file không đọc/parse được.
+    Số worker mặc định lấy từ settings.CKG_PARSE_MAX_WORKERS (None -> os.cpu_count()), không vượt quá số file.
+    Khi parse qua process pool, body_node của các entity là None vì Node không đi qua được ranh giới process.
+    Nếu một worker chết giữa chừng, các file chưa có kết quả được parse lại từng file một -> file gây lỗi chỉ trả về None.
+    """
+    if not file_paths:
+        return []
+    workers = min(max_workers or settings.CKG_PARSE_MAX_WORKERS or os.cpu_count() or 1, len(file_paths))
+    if workers <= 1:
+        # Một worker thì không đáng tạo process pool (spawn process + pickle kết quả): parse ngay trong process hiện tại
+        return [_parse_file_in_worker(file_path, language, root_dir) for file_path in file_paths]
+    results: List[Optional[ParsedFileResult]] = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker, initargs=(language,)) as executor:
+            # chunksize gom nhiều file vào một lần gửi task để giảm chi phí IPC cho repo nhiều file nhỏ
+            for result in executor.map(_parse_file_in_worker, file_paths, repeat(language), repeat(root_dir), chunksize=chunksize):
+                results.append(result)
+    except BrokenProcessPool as e: # Một worker chết (crash/OOM) khi parse một file nào đó
+        remaining_paths = file_paths[len(results):]
+        logger.warning(f"CKG Parser: Parallel parsing of {language} files failed ({e!r}). Parsing the remaining {len(remaining_paths)} files one at a time.")
+        results.extend(_parse_files_one_by_one(remaining_paths, language, root_dir))
+    return results
+
+def _parse_files_one_by_one(file_paths: List[str], language: str, root_dir: Optional[str]) -> List[Optional[ParsedFileResult]]:
+    # Mỗi file chạy riêng trong một worker (không parse trong process hiện tại: file làm crash worker có thể crash cả server),
+    # nên file gây lỗi chỉ làm mất chính nó; pool bị hỏng thì tạo pool mới cho các file tiếp theo
+    results: List[Optional[ParsedFileResult]] = []
+    executor: Optional[ProcessPoolExecutor] = None
+    try:
+        for file_path in file_paths:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=1, initializer=_init_parse_worker, initargs=(language,))
+            # Lỗi khi tạo worker process (trong submit) không phải lỗi của file -> để caller xử lý
+            future = executor.submit(_parse_file_in_worker, file_path, language, root_dir)
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as e:
+                logger.error(f"CKG Parser: Worker process died while parsing {file_path}: {e}. Skipping this file.")
+                results.append(None)
+                executor.shutdown(wait=False)
+                executor = None
+            except Exception as e:
+                logger.error(f"CKG Parser: Could not parse {file_path} in worker process: {e}. Skipping this file.")
+                results.append(None)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
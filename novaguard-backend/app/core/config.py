@@ -44,6 +44,11 @@ class Settings(BaseSettings):
     NEO4J_PASSWORD: str = "your_default_neo4j_password" # Sẽ bị override bởi .env
     # NEO4J_AUTH: str | None = None
 
+    # CKG Builder settings
+    CKG_PARSE_CACHE_PATH: str | None = None # File SQLite cache kết quả parse theo hash nội dung; None = tắt cache
+    CKG_PARSE_CACHE_MAX_ENTRIES: int = 100_000 # Số entry tối đa của parse cache; vượt quá thì xóa các entry cũ nhất
+    CKG_PARSE_MAX_WORKERS: int | None = None # Số process parse file song song khi build CKG; None = os.cpu_count()
+
     
     
     NOVAGUARD_PUBLIC_URL: str | None = None # Ví dụ: https://abcdef123.ngrok.io hoặc https://novaguard.yourcompany.com
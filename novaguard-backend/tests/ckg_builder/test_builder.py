@@ -0,0 +1,73 @@
+# novaguard-backend/tests/ckg_builder/test_builder.py
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.ckg_builder import parsers as ckg_parsers
+from app.ckg_builder.builder import CKGBuilder
+from app.ckg_builder.parsers import ParsedFileResult
+
+
+class TestCKGBuilderBuildFromPath(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = self.tmp_dir.name
+        self._write("pkg/service.py", "class Service:\n    def run(self):\n        helper()\n")
+        self._write("pkg/util.py", "def helper():\n    return 42\n")
+        self._write("tests/test_service.py", "def test_run():\n    assert True\n") # Thư mục bị bỏ qua
+        self._write("README.md", "# Project documentation\n") # Extension bị bỏ qua
+
+        project = MagicMock(id=7, repo_name="demo/repo", language="python")
+        self.builder = CKGBuilder(project, neo4j_driver=MagicMock())
+        self.builder._ensure_project_node = AsyncMock()
+        self.builder._write_parsed_file_to_ckg = AsyncMock()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, relative_path: str, content: str):
+        file_path = os.path.join(self.repo_path, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    async def test_files_are_parsed_with_parse_many_and_written_with_repo_paths(self):
+        with patch("app.ckg_builder.builder.parse_many", wraps=ckg_parsers.parse_many) as mock_parse_many:
+            processed_count = await self.builder.build_for_project_from_path(self.repo_path)
+
+        self.assertEqual(processed_count, 2)
+        mock_parse_many.assert_called_once()
+        self.assertEqual(mock_parse_many.call_args.kwargs["root_dir"], self.repo_path)
+
+        written = {call.args[0]: call.args[1] for call in self.builder._write_parsed_file_to_ckg.await_args_list}
+        service_path, util_path = os.path.join("pkg", "service.py"), os.path.join("pkg", "util.py")
+        self.assertEqual(set(written), {service_path, util_path})
+        self.assertIsInstance(written[service_path], ParsedFileResult)
+        self.assertEqual(written[service_path].file_path, service_path)
+        self.assertEqual(written[service_path].classes[0].methods[0].calls, {("helper", None, "direct", 3)})
+        self.assertEqual([f.name for f in written[util_path].functions], ["helper"])
+
+    async def test_failed_parallel_parsing_falls_back_to_in_process(self):
+        def parse_many_without_pool(file_paths, language, **kwargs):
+            if kwargs.get("max_workers") != 1:
+                raise OSError("cannot start worker processes")
+            return ckg_parsers.parse_many(file_paths, language, **kwargs)
+
+        with patch("app.ckg_builder.builder.parse_many", side_effect=parse_many_without_pool) as mock_parse_many:
+            processed_count = await self.builder.build_for_project_from_path(self.repo_path)
+
+        self.assertEqual(processed_count, 2)
+        self.assertEqual(mock_parse_many.call_count, 2)
+        self.assertEqual(mock_parse_many.call_args.kwargs["max_workers"], 1)
+
+    async def test_unreadable_files_are_skipped(self):
+        with patch("app.ckg_builder.builder.parse_many", return_value=[None, None]):
+            processed_count = await self.builder.build_for_project_from_path(self.repo_path)
+        self.assertEqual(processed_count, 0)
+        self.builder._write_parsed_file_to_ckg.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
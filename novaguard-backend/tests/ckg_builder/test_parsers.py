@@ -0,0 +1,545 @@
+# novaguard-backend/tests/ckg_builder/test_parsers.py
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import closing
+from unittest.mock import MagicMock, patch
+
+from app.ckg_builder import parsers as ckg_parsers
+from app.ckg_builder.parse_cache import ParsedResultCache
+from app.ckg_builder.parsers import _make_parser, get_code_parser, node_kind_ids, parse_many, PythonParser, ParsedFileResult, TreeEdit
+from app.core.config import settings
+
+SAMPLE_PYTHON_SOURCE = '''import os
+import numpy as np
+from a.b import c, d as e
+
+class Base:
+    pass
+
+class Child(Base):
+    def run(self, x) -> int:
+        self.prepare()
+        helper(x)
+        return os.path.join("a", "b")
+
+    def prepare(self):
+        pass
+
+def helper(value):
+    print(value)
+'''
+
+_real_parse_file_in_worker = ckg_parsers._parse_file_in_worker
+
+def _parse_file_or_crash_worker(file_path, language, root_dir):
+    # Giả lập file làm chết worker (segfault/OOM) trong process pool
+    if "crash" in file_path:
+        os._exit(1)
+    return _real_parse_file_in_worker(file_path, language, root_dir)
+
+class TestPythonParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = get_code_parser("python")
+        self.result = self.parser.parse(SAMPLE_PYTHON_SOURCE, "pkg/sample.py")
+
+    def test_get_code_parser_returns_cached_python_parser(self):
+        self.assertIsInstance(self.parser, PythonParser)
+        self.assertIs(get_code_parser(" Python "), self.parser)
+        self.assertIsNone(get_code_parser("cobol"))
+        self.assertIsNone(get_code_parser(""))
+
+    def test_queries_are_compiled_once_and_shared_between_instances(self):
+        another_parser = PythonParser()
+        self.assertIs(another_parser.lang_object, self.parser.lang_object)
+        self.assertIs(another_parser.queries, self.parser.queries)
+        self.assertEqual(set(another_parser.queries), set(PythonParser.QUERY_DEFINITIONS))
+
+    def test_queries_are_compiled_once_when_parsers_are_created_concurrently(self):
+        created_parsers = []
+        with patch.dict(PythonParser._QUERY_CACHE, clear=True):
+            workers = [threading.Thread(target=lambda: created_parsers.append(PythonParser())) for _ in range(8)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual(len(PythonParser._QUERY_CACHE), 1)
+        self.assertEqual(len({id(parser.queries) for parser in created_parsers}), 1)
+
+    def test_tree_sitter_parser_is_reused_per_thread(self):
+        self.assertIs(self.parser.parser, PythonParser().parser)
+        other_thread_parsers = []
+        worker = threading.Thread(target=lambda: other_thread_parsers.append(self.parser.parser))
+        worker.start(); worker.join()
+        self.assertIsNot(other_thread_parsers[0], self.parser.parser)
+
+    def test_node_kind_ids_match_parsed_node_kinds(self):
+        function_node = self.parser.parser.parse(b"def f():\n    pass\n").root_node.children[0]
+        self.assertIn(function_node.kind_id, node_kind_ids("python", "function_definition"))
+        self.assertIn(function_node.children[-1].kind_id, node_kind_ids("python", "block"))
+        self.assertEqual(node_kind_ids("python", "no_such_kind"), frozenset())
+
+    def test_parse_returns_result_for_file(self):
+        self.assertIsInstance(self.result, ParsedFileResult)
+        self.assertEqual(self.result.file_path, "pkg/sample.py")
+        self.assertEqual(self.result.language, "python")
+
+    def test_extract_imports(self):
+        imports = [(imp.import_type, imp.module_path, imp.imported_names) for imp in self.result.imports]
+        self.assertIn(("direct", "os", [("os", None)]), imports)
+        self.assertIn(("direct_alias", "numpy", [("numpy", "np")]), imports)
+        # Tất cả các tên trong một câu lệnh `from ... import` được gom vào một ExtractedImport
+        self.assertIn(("from", "a.b", [("c", None), ("d", "e")]), imports)
+        self.assertEqual(len(imports), 3)
+
+    def test_every_name_of_a_multi_name_import_is_extracted(self):
+        result = self.parser.parse("import os, sys as system, json\n", "multi.py")
+        imports = [(imp.import_type, imp.module_path, imp.imported_names) for imp in result.imports]
+        self.assertEqual(imports, [
+            ("direct", "os", [("os", None)]),
+            ("direct_alias", "sys", [("sys", "system")]),
+            ("direct", "json", [("json", None)]),
+        ])
+
+    def test_extract_relative_imports(self):
+        result = self.parser.parse("from ..pkg.mod import x\nfrom . import y, z as w\n", "pkg/sub/rel.py")
+        imports = [(imp.import_type, imp.module_path, imp.imported_names) for imp in result.imports]
+        # Đường dẫn relative không được dùng làm module_path (mọi `from . import` sẽ gộp vào một node Module ".")
+        self.assertEqual(imports, [
+            ("from", None, [("x", None)]),
+            ("from", None, [("y", None), ("z", "w")]),
+        ])
+
+    def test_extract_classes_and_methods(self):
+        classes = {cls.name: cls for cls in self.result.classes}
+        self.assertEqual(set(classes), {"Base", "Child"})
+        child = classes["Child"]
+        self.assertEqual((child.start_line, child.end_line), (8, 15))
+        self.assertEqual(child.superclasses, {"Base"})
+        self.assertEqual([m.name for m in child.methods], ["run", "prepare"])
+
+        run_method = child.methods[0]
+        self.assertEqual(run_method.class_name, "Child")
+        self.assertEqual(run_method.signature, "(self, x) -> int")
+        self.assertEqual(run_method.parameters_str, "(self, x)")
+        self.assertEqual(run_method.calls, {
+            ("prepare", "self", "method", 10),
+            ("helper", None, "direct", 11),
+            ("join", None, "method", 12),
+        })
+
+    def test_repeated_identifiers_share_one_string_object(self):
+        result = self.parser.parse("def a(self):\n    self.run()\n\ndef b(self):\n    self.run()\n", "intern.py")
+        (called_a, base_a, type_a, _), = result.functions[0].calls
+        (called_b, base_b, type_b, _), = result.functions[1].calls
+        self.assertIs(called_a, called_b)
+        self.assertIs(base_a, base_b)
+        self.assertIs(type_a, type_b)
+
+    def test_extract_global_functions(self):
+        self.assertEqual([f.name for f in self.result.functions], ["helper"])
+        helper = self.result.functions[0]
+        self.assertIsNone(helper.class_name)
+        self.assertEqual((helper.start_line, helper.end_line), (17, 18))
+        self.assertEqual(helper.calls, {("print", None, "direct", 18)})
+
+    def test_calls_belong_to_every_enclosing_extracted_function(self):
+        source = (
+            "def outer():\n"
+            "    class Local:\n"
+            "        def inner(self):\n"
+            "            deep()\n"
+            "    shallow()\n"
+            "\n"
+            "top_level()\n"
+        )
+        result = self.parser.parse(source, "nested.py")
+        self.assertEqual(result.functions[0].calls, {("deep", None, "direct", 4), ("shallow", None, "direct", 5)})
+        self.assertEqual(result.classes[0].methods[0].calls, {("deep", None, "direct", 4)})
+
+    def test_node_text_uses_byte_offsets_for_non_ascii_source(self):
+        source = 'greeting = "xin chào"\n\ndef chào_bạn(tên):\n    in_ra(tên)\n'
+        result = self.parser.parse(source, "unicode.py")
+        self.assertEqual([f.name for f in result.functions], ["chào_bạn"])
+        self.assertEqual(result.functions[0].parameters_str, "(tên)")
+        self.assertEqual(result.functions[0].calls, {("in_ra", None, "direct", 4)})
+        # Sau khi parse xong, parser không giữ lại view tới source
+        self.assertIsNone(self.parser._source_view)
+
+    def test_concurrent_parses_on_shared_parser_do_not_mix_files(self):
+        thread_count, parses_per_thread = 4, 30
+        # File lớn dần + có lỗi cú pháp ở một số file để các lần parse đan xen nhau
+        sources = {
+            (thread_index, parse_index): "".join(
+                f"def fn_{thread_index}_{parse_index}_{func_index}(x):\n    call_{thread_index}_{parse_index}(x)\n\n"
+                for func_index in range(20 + parse_index % 7)
+            ) + (f"def fn_{thread_index}_{parse_index}_broken(:\n" if parse_index % 3 == 0 else "")
+            for thread_index in range(thread_count) for parse_index in range(parses_per_thread)
+        }
+        barrier = threading.Barrier(thread_count)
+        mismatches = []
+
+        def worker(thread_index):
+            barrier.wait()
+            for parse_index in range(parses_per_thread):
+                result = self.parser.parse(sources[(thread_index, parse_index)], f"f{thread_index}_{parse_index}.py")
+                expected_prefix = f"fn_{thread_index}_{parse_index}_"
+                names = [f.name for f in result.functions]
+                calls = {call[0] for f in result.functions for call in f.calls}
+                if not names or not all(name.startswith(expected_prefix) for name in names) or \
+                   calls != {f"call_{thread_index}_{parse_index}"}:
+                    mismatches.append((thread_index, parse_index, names))
+
+        workers = [threading.Thread(target=worker, args=(thread_index,)) for thread_index in range(thread_count)]
+        # Chuyển thread thường xuyên hơn để các lần parse thực sự chạy xen kẽ nhau
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(mismatches, [])
+
+    def test_result_objects_use_slots(self):
+        for obj in (self.result, self.result.imports[0], self.result.classes[0], self.result.functions[0]):
+            self.assertFalse(hasattr(obj, "__dict__"), type(obj).__name__)
+
+    def test_parse_file_with_syntax_error_still_returns_result(self):
+        result = self.parser.parse("def ok():\n    pass\n\ndef broken(:\n", "broken.py")
+        self.assertIsNotNone(result)
+        self.assertIn("ok", [f.name for f in result.functions])
+
+    def test_matches_inside_error_nodes_are_skipped(self):
+        valid_prefix = "".join(f"def helper_{index}():\n    return compute({index})\n\n" for index in range(6))
+        result = self.parser.parse(valid_prefix + "def f():\n    a = [\n\ndef g():\n    bar()\n", "partly_broken.py")
+        self.assertEqual(len(result.functions), 7)
+        # Tree-sitter khôi phục `def g()` thành một call tên "def" bên trong node ERROR
+        self.assertEqual(result.functions[-1].calls, {("bar", None, "direct", 23)})
+
+    def test_error_scan_stops_once_error_budget_is_exceeded(self):
+        tree = self.parser.parser.parse(b"x = 1 +\ny = 2\nz = 3 *\nw = 4\n")
+        _, all_ranges = PythonParser._scan_syntax_errors(tree)
+        self.assertGreater(len(all_ranges), 1)
+        first_error, partial_ranges = PythonParser._scan_syntax_errors(tree, max_error_bytes=0)
+        self.assertEqual(partial_ranges, all_ranges[:1])
+        self.assertEqual(first_error.start_point[0], 0)
+
+    def test_mostly_broken_file_yields_empty_result(self):
+        result = self.parser.parse("import os\n" + "@@@ $$$ !!!\n" * 5 + "def h():\n    baz()\n", "garbage.py")
+        self.assertIsNotNone(result)
+        self.assertEqual((result.imports, result.classes, result.functions), ([], [], []))
+
+    def test_find_first_error_node(self):
+        tree = self.parser.parser.parse(b"x = 1\n\ny = (1,\n")
+        error_node = PythonParser._find_first_error_node(tree)
+        self.assertIsNotNone(error_node)
+        self.assertEqual(error_node.start_point[0], 2)
+        self.assertIsNone(PythonParser._find_first_error_node(self.parser.parser.parse(b"x = 1\n")))
+
+
+class TestParseFile(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = PythonParser()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, name: str, content: bytes) -> str:
+        file_path = os.path.join(self.tmp_dir.name, name)
+        with open(file_path, "wb") as f:
+            f.write(content)
+        return file_path
+
+    def test_parse_file_matches_parse(self):
+        file_path = self._write("sample.py", SAMPLE_PYTHON_SOURCE.encode("utf-8"))
+        from_file = self.parser.parse_file(file_path)
+        from_text = self.parser.parse(SAMPLE_PYTHON_SOURCE, file_path)
+        self.assertEqual([c.name for c in from_file.classes], [c.name for c in from_text.classes])
+        self.assertEqual(from_file.classes[1].methods[0].calls, from_text.classes[1].methods[0].calls)
+        self.assertEqual([imp.imported_names for imp in from_file.imports], [imp.imported_names for imp in from_text.imports])
+
+    def test_parse_file_handles_empty_invalid_utf8_and_missing_files(self):
+        self.assertEqual(self.parser.parse_file(self._write("empty.py", b"")).functions, [])
+        # Byte không phải UTF-8 không làm hỏng cả file
+        result = self.parser.parse_file(self._write("latin1.py", "x = 'caf\xe9'\n\ndef ok():\n    pass\n".encode("latin-1")))
+        self.assertEqual([f.name for f in result.functions], ["ok"])
+        # File không phải UTF-8 được đọc theo latin-1: định danh giữ nguyên ký tự, không bị thay bằng U+FFFD
+        result = self.parser.parse_file(self._write("latin1_name.py", "def caf\xe9(x\xe9):\n    r\xe9sum\xe9(x\xe9)\n".encode("latin-1")))
+        self.assertEqual([f.name for f in result.functions], ["caf\xe9"])
+        self.assertEqual(result.functions[0].parameters_str, "(x\xe9)")
+        self.assertEqual(result.functions[0].calls, {("r\xe9sum\xe9", None, "direct", 2)})
+        self.assertIsNone(self.parser.parse_file(os.path.join(self.tmp_dir.name, "missing.py")))
+
+    def test_parse_file_normalizes_line_endings_like_text_mode(self):
+        crlf = self.parser.parse_file(self._write("crlf.py", b"x = 1\r\ndef f(a,\r\n      b):\r\n    g()\r\n"))
+        self.assertEqual(crlf.functions[0].parameters_str, "(a,\n      b)")
+        self.assertEqual((crlf.functions[0].start_line, crlf.functions[0].end_line), (2, 4))
+        # \r đơn lẻ cũng là xuống dòng (universal newlines), kể cả khi file phải đọc lại theo latin-1
+        for name, content in (("cr.py", b"x = 1\rdef f():\r    g()\r"), ("cr_latin1.py", b"x = '\xe9'\rdef f():\r    g()\r")):
+            result = self.parser.parse_file(self._write(name, content))
+            self.assertEqual((result.functions[0].start_line, result.functions[0].end_line), (2, 3), name)
+            self.assertEqual(result.functions[0].calls, {("g", None, "direct", 3)}, name)
+
+
+class TestParseIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = PythonParser()
+
+    def test_edit_reuses_previous_tree(self):
+        old_source = "def alpha():\n    pass\n\ndef beta():\n    pass\n"
+        self.parser.parse_incremental(old_source, "pkg/inc.py")
+        old_tree = self.parser._tree_cache["pkg/inc.py"]
+
+        # Đổi tên `beta` -> `gamma_func`
+        start = old_source.index("beta")
+        new_source = old_source[:start] + "gamma_func" + old_source[start + 4:]
+        edit = TreeEdit(start, start + 4, start + 10, (3, 4), (3, 8), (3, 14))
+        spy_parser = MagicMock(wraps=self.parser.parser)
+        with patch("app.ckg_builder.parsers.get_parser", return_value=spy_parser):
+            result = self.parser.parse_incremental(new_source, "pkg/inc.py", edits=[edit])
+
+        self.assertIs(spy_parser.parse.call_args.args[1], old_tree)
+        self.assertEqual([f.name for f in result.functions], ["alpha", "gamma_func"])
+        self.assertIsNot(self.parser._tree_cache["pkg/inc.py"], old_tree)
+
+    def test_edit_is_derived_from_old_code(self):
+        old_source = "def alpha():\n    pass\n\ndef beta():\n    pass\n"
+        self.parser.parse_incremental(old_source, "pkg/diff.py")
+        old_tree = self.parser._tree_cache["pkg/diff.py"]
+
+        new_source = old_source.replace("beta", "gamma_func")
+        spy_parser = MagicMock(wraps=self.parser.parser)
+        with patch("app.ckg_builder.parsers.get_parser", return_value=spy_parser):
+            result = self.parser.parse_incremental(new_source, "pkg/diff.py", old_code=old_source)
+
+        self.assertIs(spy_parser.parse.call_args.args[1], old_tree)
+        self.assertEqual([f.name for f in result.functions], ["alpha", "gamma_func"])
+
+    def test_tree_edit_from_sources(self):
+        old_source = b"x = 1\ny = 'ab'\nz = 3\n"
+        new_source = b"x = 1\ny = '\xc3\xa9\xc3\xa9\xc3\xa9'\nz = 3\n"
+        self.assertEqual(TreeEdit.from_sources(old_source, new_source), TreeEdit(11, 13, 17, (1, 5), (1, 7), (1, 11)))
+        # Chèn ở cuối: phần cuối chung không được chồng lên phần đầu chung
+        self.assertEqual(TreeEdit.from_sources(b"a\n", b"a\na\n"), TreeEdit(2, 2, 4, (1, 0), (1, 0), (2, 0)))
+        self.assertIsNone(TreeEdit.from_sources(old_source, old_source))
+
+    def test_without_edits_falls_back_to_full_parse(self):
+        self.parser.parse_incremental("def a():\n    pass\n", "pkg/full.py")
+        result = self.parser.parse_incremental("def b():\n    pass\n", "pkg/full.py")
+        self.assertEqual([f.name for f in result.functions], ["b"])
+
+    def test_tree_cache_is_bounded(self):
+        with patch.object(PythonParser, "TREE_CACHE_SIZE", 2):
+            for index in range(3):
+                self.parser.parse_incremental("x = 1\n", f"pkg/m{index}.py")
+        self.assertEqual(list(self.parser._tree_cache), ["pkg/m1.py", "pkg/m2.py"])
+
+
+class TestParsedResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "parse_cache.sqlite3")
+        self.parser = PythonParser(cache_path=self.cache_path)
+
+    def tearDown(self):
+        self.parser._result_cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_unchanged_content_is_served_from_cache(self):
+        first = self.parser.parse(SAMPLE_PYTHON_SOURCE, "pkg/sample.py")
+        with patch.object(PythonParser, "_extract_entities") as mock_extract:
+            second = self.parser.parse(SAMPLE_PYTHON_SOURCE, "pkg/sample.py")
+        mock_extract.assert_not_called()
+        self.assertEqual([c.name for c in second.classes], [c.name for c in first.classes])
+        self.assertEqual(second.classes[1].methods[0].calls, first.classes[1].methods[0].calls)
+        self.assertIsNone(second.classes[1].body_node)
+
+    def test_changed_content_is_parsed_again(self):
+        self.parser.parse("def old():\n    pass\n", "pkg/mod.py")
+        result = self.parser.parse("def new():\n    pass\n", "pkg/mod.py")
+        self.assertEqual([f.name for f in result.functions], ["new"])
+        # Nội dung cũ vẫn được giữ: cùng path có thể là file của một project/branch khác
+        rows = self.parser._result_cache._conn.execute("SELECT COUNT(*) FROM parsed_cache WHERE path = 'pkg/mod.py'").fetchone()
+        self.assertEqual(rows[0], 2)
+
+    def test_same_path_in_different_projects_does_not_evict_each_other(self):
+        project_a_source, project_b_source = "def from_a():\n    pass\n", "def from_b():\n    pass\n"
+        self.parser.parse(project_a_source, "app/main.py")
+        self.parser.parse(project_b_source, "app/main.py")
+        with patch.object(PythonParser, "_extract_entities") as mock_extract:
+            result_a = self.parser.parse(project_a_source, "app/main.py")
+            result_b = self.parser.parse(project_b_source, "app/main.py")
+        mock_extract.assert_not_called()
+        self.assertEqual([f.name for f in result_a.functions], ["from_a"])
+        self.assertEqual([f.name for f in result_b.functions], ["from_b"])
+
+    def test_oldest_entries_are_evicted_beyond_max_entries(self):
+        cache = self.parser._result_cache
+        cache.max_entries = 3
+        with patch.object(ParsedResultCache, "EVICTION_CHECK_INTERVAL", 1), patch("app.ckg_builder.parse_cache.time.time", side_effect=range(5)):
+            for index in range(5):
+                self.parser.parse(f"def func_{index}():\n    pass\n", f"pkg/mod_{index}.py")
+        stored_paths = {row[0] for row in cache._conn.execute("SELECT path FROM parsed_cache")}
+        self.assertEqual(stored_paths, {"pkg/mod_2.py", "pkg/mod_3.py", "pkg/mod_4.py"})
+
+    def test_cache_from_older_schema_is_recreated(self):
+        old_cache_path = os.path.join(self.tmp_dir.name, "old_cache.sqlite3")
+        with closing(sqlite3.connect(old_cache_path)) as conn, conn:
+            conn.execute("CREATE TABLE parsed_cache (path TEXT NOT NULL, content_sha BLOB NOT NULL, pickled BLOB NOT NULL, PRIMARY KEY (path, content_sha))")
+        cache = ParsedResultCache(old_cache_path)
+        try:
+            content_sha = ParsedResultCache.content_key("python", b"x = 1\n")
+            cache.put("pkg/x.py", content_sha, ParsedFileResult("pkg/x.py", "python"))
+            self.assertEqual(cache.get("pkg/x.py", content_sha).file_path, "pkg/x.py")
+        finally:
+            cache.close()
+
+    def test_forked_process_reopens_its_own_connection(self):
+        cache = self.parser._result_cache
+        parent_conn = cache._conn
+        # Giả lập process con sau fork(): pid khác với pid đã mở connection
+        with patch("app.ckg_builder.parse_cache.os.getpid", return_value=cache._pid + 1):
+            self.parser.parse("def child():\n    pass\n", "pkg/child.py")
+            self.assertIsNot(cache._conn, parent_conn)
+        parent_conn.close()
+        cached = cache.get("pkg/child.py", ParsedResultCache.content_key("python", b"def child():\n    pass\n"))
+        self.assertEqual([f.name for f in cached.functions], ["child"])
+
+    def test_unopenable_cache_path_parses_without_cache(self):
+        with self.assertLogs("app.ckg_builder.parsers", level="WARNING"):
+            parser = PythonParser(cache_path=os.path.join(self.tmp_dir.name, "missing_dir", "cache.sqlite3"))
+        self.assertIsNone(parser._result_cache)
+        self.assertEqual([f.name for f in parser.parse("def f():\n    pass\n", "pkg/f.py").functions], ["f"])
+
+    def test_parse_many_with_cache_and_multiple_workers(self):
+        file_names = [f"module_{index}.py" for index in range(6)]
+        for index, file_name in enumerate(file_names):
+            with open(os.path.join(self.tmp_dir.name, file_name), "w", encoding="utf-8") as f:
+                f.write(f"def func_{index}():\n    return {index}\n")
+
+        # Ghi lại pid mở connection và pid ghi cache (worker là process fork nên phải ghi ra file)
+        pid_log_path = os.path.join(self.tmp_dir.name, "pids.log")
+        real_connect, real_put = sqlite3.connect, ParsedResultCache.put
+
+        def log_pid(event):
+            with open(pid_log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(f"{event} {os.getpid()}\n")
+
+        def logging_connect(*args, **kwargs):
+            log_pid("connect")
+            return real_connect(*args, **kwargs)
+
+        def logging_put(cache, *args, **kwargs):
+            log_pid("put")
+            return real_put(cache, *args, **kwargs)
+
+        _make_parser.cache_clear()
+        try:
+            with patch.object(settings, "CKG_PARSE_CACHE_PATH", self.cache_path), \
+                 patch("app.ckg_builder.parse_cache.sqlite3.connect", side_effect=logging_connect), \
+                 patch.object(ParsedResultCache, "put", logging_put):
+                # Parser (và connection SQLite) được tạo ở process cha trước khi pool fork worker, như trong builder
+                parent_parser = get_code_parser("python")
+                self.assertIsNotNone(parent_parser._result_cache)
+                results = parse_many(file_names, "python", max_workers=3, root_dir=self.tmp_dir.name, chunksize=1)
+                cached_again = parse_many(file_names, "python", max_workers=3, root_dir=self.tmp_dir.name, chunksize=1)
+            parent_parser._result_cache.close()
+        finally:
+            _make_parser.cache_clear()
+
+        self.assertEqual([[f.name for f in r.functions] for r in results], [[f"func_{index}"] for index in range(6)])
+        self.assertEqual([[f.name for f in r.functions] for r in cached_again], [[f"func_{index}"] for index in range(6)])
+        with closing(sqlite3.connect(self.cache_path)) as conn:
+            self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+            stored_paths = {row[0] for row in conn.execute("SELECT path FROM parsed_cache")}
+        self.assertEqual(stored_paths, set(file_names))
+        with open(pid_log_path, encoding="utf-8") as log_file:
+            events = [line.split() for line in log_file]
+        connect_pids = {pid for event, pid in events if event == "connect"}
+        put_pids = {pid for event, pid in events if event == "put"}
+        self.assertNotIn(str(os.getpid()), put_pids)
+        # Mỗi worker ghi cache bằng connection do chính nó mở, không dùng connection kế thừa từ process cha
+        self.assertTrue(put_pids <= connect_pids, (put_pids, connect_pids))
+
+
+class TestParseMany(unittest.TestCase):
+
+    def test_parsed_result_pickles_without_body_nodes(self):
+        result = get_code_parser("python").parse(SAMPLE_PYTHON_SOURCE, "pkg/sample.py")
+        self.assertIsNotNone(result.classes[1].methods[0].body_node)
+
+        restored = pickle.loads(pickle.dumps(result))
+        child = restored.classes[1]
+        self.assertEqual(child.name, "Child")
+        self.assertIsNone(child.body_node)
+        self.assertIsNone(child.methods[0].body_node)
+        self.assertEqual(child.methods[0].calls, result.classes[1].methods[0].calls)
+        self.assertEqual([imp.imported_names for imp in restored.imports], [imp.imported_names for imp in result.imports])
+
+    def test_parse_many_returns_results_in_input_order(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_paths = []
+            for index in range(3):
+                file_path = os.path.join(tmp_dir, f"module_{index}.py")
+                with open(file_path, "w", encoding="utf-8") as f:
+                    f.write(f"def func_{index}():\n    return {index}\n")
+                file_paths.append(file_path)
+            missing_path = os.path.join(tmp_dir, "missing.py")
+
+            results = parse_many(file_paths + [missing_path], "python", max_workers=2)
+
+        self.assertEqual(len(results), 4)
+        for index, result in enumerate(results[:3]):
+            self.assertEqual(result.file_path, file_paths[index])
+            self.assertEqual([f.name for f in result.functions], [f"func_{index}"])
+        self.assertIsNone(results[3])
+
+    def test_crashing_worker_only_loses_its_own_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_names = [f"module_{index}.py" for index in range(6)]
+            file_names[2] = "crash_me.py"
+            for index, file_name in enumerate(file_names):
+                with open(os.path.join(tmp_dir, file_name), "w", encoding="utf-8") as f:
+                    f.write(f"def func_{index}():\n    return {index}\n")
+
+            with patch.object(ckg_parsers, "_parse_file_in_worker", _parse_file_or_crash_worker), \
+                 self.assertLogs("app.ckg_builder.parsers", level="WARNING"):
+                results = parse_many(file_names, "python", max_workers=2, root_dir=tmp_dir, chunksize=1)
+
+        self.assertIsNone(results[2])
+        self.assertEqual([[f.name for f in r.functions] for index, r in enumerate(results) if index != 2],
+                         [[f"func_{index}"] for index in (0, 1, 3, 4, 5)])
+
+    def test_parse_many_with_no_files(self):
+        self.assertEqual(parse_many([], "python"), [])
+
+    def test_single_worker_parses_in_process(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for index in range(2):
+                with open(os.path.join(tmp_dir, f"module_{index}.py"), "w", encoding="utf-8") as f:
+                    f.write(f"def func_{index}():\n    return {index}\n")
+
+            with patch("app.ckg_builder.parsers.ProcessPoolExecutor") as mock_pool, \
+                 patch.object(settings, "CKG_PARSE_MAX_WORKERS", 1):
+                results = parse_many(["module_0.py", "module_1.py"], "python", root_dir=tmp_dir)
+                single = parse_many(["module_0.py"], "python", max_workers=4, root_dir=tmp_dir)
+
+        mock_pool.assert_not_called()
+        self.assertEqual([[f.name for f in r.functions] for r in results], [["func_0"], ["func_1"]])
+        self.assertEqual(single[0].file_path, "module_0.py")
+
+
+if __name__ == '__main__':
+    unittest.main()